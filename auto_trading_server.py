@@ -2,22 +2,62 @@
 """
 Polymarket 自动交易服务器 - 简化版
 """
-from flask import Flask, jsonify, request, send_from_directory
+import time
+_IMPORT_STARTED = time.perf_counter()
+
+from flask import Flask, g, has_request_context, jsonify, request, send_from_directory
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
-import requests
 import os
 import sys
+import threading
+import traceback
 from datetime import datetime, timezone
-from py_clob_client import ClobClient
-from py_clob_client.clob_types import OrderArgs
-from py_clob_client.constants import POLYGON
+
+import fastjson
+from circuit_breaker import BREAKERS
+from market_data import MarketCache
+from positions_cache import PositionsCache, reset_session as reset_positions_session, session as positions_session
+from state_backend import MemoryBackend, create_backend
+from strategy import buy_cheaper_side, market_prices
+from strategy_engine import OrderSubmitter, StrategyEngine, load_plugins
 
 # 强制刷新输出
 sys.stdout.reconfigure(line_buffering=True)
 
+class FastJSONProvider(DefaultJSONProvider):
+    """jsonify / request.json 统一使用 fastjson 后端，并在响应头中给出序列化耗时"""
+
+    def dumps(self, obj, **kwargs):
+        return fastjson.dumps(obj).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return fastjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        body, elapsed_ms = fastjson.timed_dumps(self._prepare_response_obj(args, kwargs))
+        response = self._app.response_class(body, mimetype=self.mimetype)
+        response.headers['Server-Timing'] = f"json;dur={elapsed_ms:.3f}"
+        return response
+
 app = Flask(__name__, static_folder='/root/poly_data')
+app.json = FastJSONProvider(app)
 CORS(app)
 
+def note_staleness(meta):
+    """记录本次请求用到的旧数据，响应时通过 X-Stale / Age 头标记"""
+    if meta.get('stale') and has_request_context():
+        g.stale_age = max(g.get('stale_age', 0), meta['age'])
+
+@app.after_request
+def mark_stale_response(response):
+    """上游异常时返回的是缓存中的旧数据，告知客户端数据年龄"""
+    stale_age = g.get('stale_age')
+    if stale_age is not None:
+        response.headers['X-Stale'] = 'true'
+        response.headers['Age'] = str(int(stale_age))
+    return response
+
 # 提供静态文件（放在API路由之后定义，避免冲突）
 @app.route('/')
 def index():
@@ -60,16 +100,30 @@ PROXY_ADDRESS = os.environ.get('PROXY_ADDRESS', '0xc891EA46e4591612c92AA913089fb
 # 全局变量存储客户端实例
 _client_instance = None
 _api_creds_created = False
+_client_lock = threading.Lock()
 
 # 初始化 CLOB 客户端
 def get_clob_client():
     """获取 CLOB 客户端实例，使用代理钱包模式"""
     global _client_instance, _api_creds_created
 
-    try:
-        # 如果已经创建了客户端实例，直接返回
+    # 如果已经创建了客户端实例，直接返回
+    if _client_instance is not None:
+        return _client_instance
+
+    # 预热线程和请求可能同时初始化，只派生一次 API 凭证
+    with _client_lock:
         if _client_instance is not None:
             return _client_instance
+        return _create_clob_client()
+
+def _create_clob_client():
+    global _client_instance, _api_creds_created
+
+    try:
+        # 只有下单时才需要，延迟导入以加快启动
+        from py_clob_client import ClobClient
+        from py_clob_client.constants import POLYGON
 
         print(f"初始化 ClobClient (代理钱包模式)...")
         print(f"私钥: {PRIVATE_KEY[:10]}...")
@@ -94,7 +148,6 @@ def get_clob_client():
             _api_creds_created = True
         except Exception as e:
             print(f"❌ 获取API凭证失败: {e}")
-            import traceback
             traceback.print_exc()
             return None
 
@@ -104,10 +157,35 @@ def get_clob_client():
 
     except Exception as e:
         print(f"❌ 初始化客户端失败: {e}")
-        import traceback
         traceback.print_exc()
         return None
 
+# 共享状态后端：默认进程内存，多实例部署时设置 STATE_BACKEND=redis://host:6379/0
+state_backend = create_backend(os.environ.get('STATE_BACKEND'))
+
+# gamma 市场缓存（进入缓存时一次性解析字符串数组字段）
+market_cache = MarketCache(ttl=float(os.environ.get('MARKET_CACHE_TTL', '2')), backend=state_backend)
+
+# 持仓缓存（按钱包，短 TTL + 内容哈希）
+positions_cache = PositionsCache(ttl=float(os.environ.get('POSITIONS_CACHE_TTL', '5')), backend=state_backend)
+
+# 共享下单器：/api/place_orders 和策略引擎都通过它提交订单，下单成功后立即失效自己钱包的持仓缓存
+order_submitter = OrderSubmitter(
+    get_clob_client,
+    on_filled=lambda result: positions_cache.invalidate(PROXY_ADDRESS),
+    backend=state_backend
+)
+
+# 事件驱动策略引擎（STRATEGY_ENGINE=1 时随服务器启动）
+strategy_engine = StrategyEngine(
+    order_submitter,
+    plugins=load_plugins(os.environ.get('STRATEGY_CONFIG')),
+    poll_interval=float(os.environ.get('STRATEGY_POLL_INTERVAL', '1.0')),
+    record_dir=os.environ.get('MARKET_RECORD_DIR'),
+    market_cache=market_cache,
+    backend=state_backend
+)
+
 def get_current_btc_market():
     """获取当前 BTC 15 分钟市场"""
     now = datetime.now(timezone.utc)
@@ -117,29 +195,34 @@ def get_current_btc_market():
 
     slug = f"btc-updown-15m-{current_ts}"
 
-    response = requests.get(
-        f"https://gamma-api.polymarket.com/markets/slug/{slug}",
-        timeout=10
-    )
-
-    if response.status_code == 200:
-        market = response.json()
-        if market and market.get('acceptingOrders'):
-            return market
+    meta = {}
+    market = market_cache.get_market(slug, meta=meta)
+    note_staleness(meta)
+    if market and market.get('acceptingOrders'):
+        return market
 
     # 如果当前窗口没有，尝试上一个
     prev_ts = current_ts - 15 * 60
     slug_prev = f"btc-updown-15m-{prev_ts}"
 
-    response2 = requests.get(
-        f"https://gamma-api.polymarket.com/markets/slug/{slug_prev}",
-        timeout=10
-    )
-
-    if response2.status_code == 200:
-        return response2.json()
-
-    return None
+    meta = {}
+    market = market_cache.get_market(slug_prev, meta=meta)
+    note_staleness(meta)
+    return market
+
+def get_event_market(slug):
+    """从缓存获取 events/slug 的市场（上游故障时可能是旧数据）"""
+    meta = {}
+    market = market_cache.get_event_market(slug, meta=meta)
+    note_staleness(meta)
+    return market
+
+def get_positions_memo(wallet, key, compute):
+    """从持仓缓存获取处理结果（上游故障时可能基于旧数据）"""
+    meta = {}
+    result = positions_cache.memo(wallet, key, compute, meta=meta)
+    note_staleness(meta)
+    return result
 
 @app.route('/api/get_market')
 def get_market():
@@ -148,15 +231,9 @@ def get_market():
         market = get_current_btc_market()
 
         if market:
-            import json
-
-            # 解析 token IDs
-            token_ids_str = market.get('clobTokenIds', '[]')
-            token_ids = json.loads(token_ids_str) if isinstance(token_ids_str, str) else token_ids_str
-
-            # 解析价格
-            outcome_prices_str = market.get('outcomePrices', '[0.5, 0.5]')
-            outcome_prices = json.loads(outcome_prices_str) if isinstance(outcome_prices_str, str) else outcome_prices_str
+            # 缓存中的市场已解析 token IDs 和价格
+            token_ids = market.get('clobTokenIds') or []
+            outcome_prices = market.get('outcomePrices') or [0.5, 0.5]
 
             return jsonify({
                 'success': True,
@@ -178,6 +255,70 @@ def get_market():
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+def aggregate_btc_positions(positions, current_question):
+    """聚合当前 BTC 市场的 UP/DOWN 持仓，返回加权均价列表"""
+    aggregated = {
+        'Up': {'size': 0, 'avg_price': 0, 'total_cost': 0, 'count': 0},
+        'Down': {'size': 0, 'avg_price': 0, 'total_cost': 0, 'count': 0}
+    }
+
+    for pos in positions:
+        title = pos.get('title', '')
+        # 只处理当前市场的持仓
+        if title == current_question and 'Bitcoin Up or Down' in title:
+            outcome = pos.get('outcome', '')
+            if outcome in ['Up', 'Down']:
+                size = pos.get('size', 0)
+                avg_price = pos.get('avgPrice', 0)
+
+                aggregated[outcome]['size'] += size
+                aggregated[outcome]['total_cost'] += size * avg_price
+                aggregated[outcome]['count'] += 1
+
+    # 计算加权平均价
+    result_positions = []
+    for outcome in ['Up', 'Down']:
+        data = aggregated[outcome]
+        if data['size'] > 0:
+            weighted_avg = data['total_cost'] / data['size']
+            result_positions.append({
+                'outcome': outcome,
+                'size': round(data['size'], 2),
+                'avg_price': round(weighted_avg, 4),
+                'count': data['count']
+            })
+
+    return result_positions
+
+def select_current_positions(positions, markets):
+    """筛选 BTC 和 ETH 当前市场的持仓，并标记市场类型"""
+    current_positions = []
+    market_questions = [m['question'] for m in markets.values()]
+
+    for pos in positions:
+        if pos.get('title', '') in market_questions:
+            # 复制后再添加标记，缓存中的原始持仓保持不变
+            pos = dict(pos)
+            for slug, info in markets.items():
+                if pos.get('title') == info['question']:
+                    pos['market_type'] = 'BTC' if 'btc' in slug else 'ETH'
+                    pos['market_slug'] = slug
+                    break
+            current_positions.append(pos)
+
+    return current_positions
+
+def match_positions(positions, questions):
+    """按市场标题匹配持仓，返回 [(coin, pos)]；questions 为 (coin, question) 元组"""
+    matched = []
+    for pos in positions:
+        pos_title = pos.get('title', '')
+        for coin, question in questions:
+            if pos_title == question:
+                matched.append((coin, pos))
+                break
+    return matched
+
 @app.route('/api/get_positions')
 def get_positions():
     """获取当前市场持仓（只显示当前市场，聚合UP和DOWN）"""
@@ -190,53 +331,17 @@ def get_positions():
         current_market = get_current_btc_market()
         current_question = current_market.get('question', '') if current_market else ''
 
-        response = requests.get(
-            f'https://data-api.polymarket.com/positions?user={wallet}&limit=500',
-            timeout=10
+        # 持仓未变化时直接复用上次的聚合结果
+        result_positions = get_positions_memo(
+            wallet, ('btc_aggregate', current_question),
+            lambda positions: aggregate_btc_positions(positions, current_question)
         )
 
-        if response.ok:
-            positions = response.json()
-
-            # 聚合当前市场的持仓
-            aggregated = {
-                'Up': {'size': 0, 'avg_price': 0, 'total_cost': 0, 'count': 0},
-                'Down': {'size': 0, 'avg_price': 0, 'total_cost': 0, 'count': 0}
-            }
-
-            for pos in positions:
-                title = pos.get('title', '')
-                # 只处理当前市场的持仓
-                if title == current_question and 'Bitcoin Up or Down' in title:
-                    outcome = pos.get('outcome', '')
-                    if outcome in ['Up', 'Down']:
-                        size = pos.get('size', 0)
-                        avg_price = pos.get('avgPrice', 0)
-
-                        aggregated[outcome]['size'] += size
-                        aggregated[outcome]['total_cost'] += size * avg_price
-                        aggregated[outcome]['count'] += 1
-
-            # 计算加权平均价
-            result_positions = []
-            for outcome in ['Up', 'Down']:
-                data = aggregated[outcome]
-                if data['size'] > 0:
-                    weighted_avg = data['total_cost'] / data['size']
-                    result_positions.append({
-                        'outcome': outcome,
-                        'size': round(data['size'], 2),
-                        'avg_price': round(weighted_avg, 4),
-                        'count': data['count']
-                    })
-
-            return jsonify({
-                'success': True,
-                'positions': result_positions,
-                'current_market': current_question
-            })
-
-        return jsonify({'success': True, 'positions': [], 'current_market': current_question})
+        return jsonify({
+            'success': True,
+            'positions': result_positions or [],
+            'current_market': current_question
+        })
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -248,7 +353,6 @@ def get_positions_raw():
         return jsonify({'error': 'Missing wallet parameter'}), 400
 
     try:
-        import time
         # 获取当前15分钟窗口
         current_time = int(time.time())
         current_period = (current_time // 900) * 900
@@ -261,48 +365,26 @@ def get_positions_raw():
         markets = {}
         for slug in [btc_slug, eth_slug]:
             try:
-                url = f"https://gamma-api.polymarket.com/events/slug/{slug}"
-                resp = requests.get(url, timeout=5)
-                if resp.status_code == 200:
-                    data = resp.json()
-                    if data and data.get("markets"):
-                        market = data["markets"][0]
-                        markets[slug] = {
-                            'question': market.get("question", ""),
-                            'slug': slug
-                        }
-            except:
-                pass
-
-        response = requests.get(
-            f'https://data-api.polymarket.com/positions?user={wallet}&limit=500',
-            timeout=10
-        )
-
-        if response.ok:
-            positions = response.json()
-
-            # 筛选 BTC 和 ETH 当前市场的持仓
-            current_positions = []
-            market_questions = [m['question'] for m in markets.values()]
-
-            for pos in positions:
-                if pos.get('title', '') in market_questions:
-                    # 添加市场类型标记
-                    for slug, info in markets.items():
-                        if pos.get('title') == info['question']:
-                            pos['market_type'] = 'BTC' if 'btc' in slug else 'ETH'
-                            pos['market_slug'] = slug
-                            break
-                    current_positions.append(pos)
+                market = get_event_market(slug)
+                if market:
+                    markets[slug] = {
+                        'question': market.get("question", ""),
+                        'slug': slug
+                    }
+            except Exception as e:
+                print(f"获取市场失败 {slug}: {e}")
 
-            return jsonify({
-                'success': True,
-                'positions': current_positions,
-                'markets': markets
-            })
+        # 筛选 BTC 和 ETH 当前市场的持仓（持仓未变化时复用）
+        current_positions = get_positions_memo(
+            wallet, ('current_positions', tuple(sorted((k, v['question']) for k, v in markets.items()))),
+            lambda positions: select_current_positions(positions, markets)
+        )
 
-        return jsonify({'success': True, 'positions': [], 'markets': markets})
+        return jsonify({
+            'success': True,
+            'positions': current_positions or [],
+            'markets': markets
+        })
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -310,8 +392,6 @@ def get_positions_raw():
 def get_market_prices():
     """获取当前BTC和ETH市场的实时价格"""
     try:
-        import time
-        import json
 
         current_time = int(time.time())
         current_period = (current_time // 900) * 900
@@ -321,18 +401,14 @@ def get_market_prices():
         for coin in ['btc', 'eth']:
             slug = f"{coin}-updown-15m-{current_period}"
             try:
-                url = f"https://gamma-api.polymarket.com/events/slug/{slug}"
-                resp = requests.get(url, timeout=5)
-                if resp.status_code == 200:
-                    data = resp.json()
-                    if data and data.get("markets"):
-                        market = data["markets"][0]
-                        outcome_prices = json.loads(market.get("outcomePrices", "[]"))
-                        markets_data[coin.upper()] = {
-                            'up_price': float(outcome_prices[0]) if outcome_prices else 0.5,
-                            'down_price': float(outcome_prices[1]) if len(outcome_prices) > 1 else 0.5,
-                            'slug': slug
-                        }
+                market = get_event_market(slug)
+                if market:
+                    outcome_prices = market.get("outcomePrices") or []
+                    markets_data[coin.upper()] = {
+                        'up_price': outcome_prices[0] if outcome_prices else 0.5,
+                        'down_price': outcome_prices[1] if len(outcome_prices) > 1 else 0.5,
+                        'slug': slug
+                    }
             except Exception as e:
                 print(f"获取{coin.upper()}价格失败: {e}")
 
@@ -352,8 +428,6 @@ def get_positions_with_prices():
         return jsonify({'error': 'Missing wallet parameter'}), 400
 
     try:
-        import time
-        import json
 
         # 获取当前15分钟窗口
         current_time = int(time.time())
@@ -364,75 +438,65 @@ def get_positions_with_prices():
         for coin in ['btc', 'eth']:
             slug = f"{coin}-updown-15m-{current_period}"
             try:
-                url = f"https://gamma-api.polymarket.com/events/slug/{slug}"
-                resp = requests.get(url, timeout=5)
-                if resp.status_code == 200:
-                    data = resp.json()
-                    if data and data.get("markets"):
-                        market = data["markets"][0]
-                        outcome_prices = json.loads(market.get("outcomePrices", "[]"))
-                        prices[coin.upper()] = {
-                            'up_price': outcome_prices[0] if outcome_prices else 0.5,
-                            'down_price': outcome_prices[1] if len(outcome_prices) > 1 else 0.5,
-                            'question': market.get("question", ""),
-                            'slug': slug
-                        }
-            except:
-                pass
-
-        # 获取持仓
-        response = requests.get(
-            f'https://data-api.polymarket.com/positions?user={wallet}&limit=500',
-            timeout=10
+                market = get_event_market(slug)
+                if market:
+                    outcome_prices = market.get("outcomePrices") or []
+                    prices[coin.upper()] = {
+                        'up_price': outcome_prices[0] if outcome_prices else 0.5,
+                        'down_price': outcome_prices[1] if len(outcome_prices) > 1 else 0.5,
+                        'question': market.get("question", ""),
+                        'slug': slug
+                    }
+            except Exception as e:
+                print(f"获取市场失败 {slug}: {e}")
+
+        # 获取持仓，只匹配当前市场（持仓未变化时复用匹配结果）
+        questions = tuple((coin, info['question']) for coin, info in prices.items())
+        matched = get_positions_memo(
+            wallet, ('match', questions),
+            lambda positions: match_positions(positions, questions)
         )
 
-        if not response.ok:
+        if matched is None:
             return jsonify({'success': False, 'error': 'Failed to fetch positions'}), 500
 
-        positions = response.json()
-
         # 筛选并处理持仓
         result = {'BTC': [], 'ETH': []}
 
-        for pos in positions:
-            pos_title = pos.get('title', '')
-
-            # 找到对应的市场
-            for coin, market_info in prices.items():
-                if pos_title == market_info['question']:
-                    outcome = pos.get('outcome', '')
-
-                    # 获取实时价格
-                    if outcome.lower() == 'up':
-                        current_price = market_info['up_price']
-                    elif outcome.lower() == 'down':
-                        current_price = market_info['down_price']
-                    else:
-                        current_price = pos.get('curPrice', 0) or 0
-
-                    # 使用实时价格计算当前价值和盈亏
-                    size = pos.get('size', 0)
-                    avg_price = pos.get('avgPrice', 0)
-                    cost_basis = size * avg_price
-                    current_value = size * current_price
-                    unrealized_pnl = current_value - cost_basis
-                    pnl_percent = ((current_value - cost_basis) / cost_basis * 100) if cost_basis > 0 else 0
-
-                    result[coin].append({
-                        'outcome': outcome,
-                        'size': size,
-                        'avg_price': avg_price,
-                        'current_price': current_price,
-                        'cost_basis': cost_basis,
-                        'current_value': current_value,
-                        'unrealized_pnl': unrealized_pnl,
-                        'pnl_percent': pnl_percent,
-                        'redeemable': pos.get('redeemable', False) or False,
-                        'mergeable': pos.get('mergeable', False) or False,
-                        'market_slug': market_info['slug'],
-                        'raw_position': pos
-                    })
-                    break
+        for coin, pos in matched:
+            market_info = prices[coin]
+            outcome = pos.get('outcome', '')
+
+            # 获取实时价格
+            if outcome.lower() == 'up':
+                current_price = market_info['up_price']
+            elif outcome.lower() == 'down':
+                current_price = market_info['down_price']
+            else:
+                current_price = pos.get('curPrice', 0) or 0
+
+            # 使用实时价格计算当前价值和盈亏
+            size = pos.get('size', 0)
+            avg_price = pos.get('avgPrice', 0)
+            cost_basis = size * avg_price
+            current_value = size * current_price
+            unrealized_pnl = current_value - cost_basis
+            pnl_percent = ((current_value - cost_basis) / cost_basis * 100) if cost_basis > 0 else 0
+
+            result[coin].append({
+                'outcome': outcome,
+                'size': size,
+                'avg_price': avg_price,
+                'current_price': current_price,
+                'cost_basis': cost_basis,
+                'current_value': current_value,
+                'unrealized_pnl': unrealized_pnl,
+                'pnl_percent': pnl_percent,
+                'redeemable': pos.get('redeemable', False) or False,
+                'mergeable': pos.get('mergeable', False) or False,
+                'market_slug': market_info['slug'],
+                'raw_position': pos
+            })
 
         return jsonify({
             'success': True,
@@ -442,7 +506,6 @@ def get_positions_with_prices():
         })
 
     except Exception as e:
-        import traceback
         traceback.print_exc()
         return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -457,62 +520,37 @@ def calculate_orders():
         if not market:
             return jsonify({'success': False, 'error': 'No active market'}), 400
 
-        token_ids = market.get('clobTokenIds', [])
-        if len(token_ids) < 2:
+        up_token, down_token, up_price, down_price = market_prices(market)
+        if not up_token or not down_token:
             return jsonify({'success': False, 'error': 'Missing token IDs'}), 400
 
-        up_token = token_ids[0]
-        down_token = token_ids[1]
-
-        outcome_prices = market.get('outcomePrices', [])
-        up_price = float(outcome_prices[0]) if outcome_prices else 0.5
-        down_price = float(outcome_prices[1]) if outcome_prices else 0.5
-
         size = data.get('size', 10)
 
-        # 策略：低价做多，高价做空
-        if up_price < down_price:
-            # Up 便宜，做多 Up
-            buy_order = {
-                'side': 'BUY',
-                'token_id': up_token,
-                'price': round(up_price * 1.015, 4),
-                'size': size,
-                'type': 'LIMIT',
-                'outcome': 'Up',
-                'current_price': up_price
-            }
-            # Down 贵，做空 Down
-            sell_order = {
-                'side': 'SELL',
-                'token_id': down_token,
-                'price': round(down_price * 0.985, 4),
-                'size': size,
-                'type': 'LIMIT',
-                'outcome': 'Down',
-                'current_price': down_price
-            }
+        # 策略：低价做多（与 place_orders 相同），高价做空
+        order = buy_cheaper_side(up_price, down_price, {'size': size})
+        if order['outcome'] == 'Up':
+            buy_token, sell_token, sell_outcome, sell_price = up_token, down_token, 'Down', down_price
         else:
-            # Down 便宜，做多 Down
-            buy_order = {
-                'side': 'BUY',
-                'token_id': down_token,
-                'price': round(down_price * 1.015, 4),
-                'size': size,
-                'type': 'LIMIT',
-                'outcome': 'Down',
-                'current_price': down_price
-            }
-            # Up 贵，做空 Up
-            sell_order = {
-                'side': 'SELL',
-                'token_id': up_token,
-                'price': round(up_price * 0.985, 4),
-                'size': size,
-                'type': 'LIMIT',
-                'outcome': 'Up',
-                'current_price': up_price
-            }
+            buy_token, sell_token, sell_outcome, sell_price = down_token, up_token, 'Up', up_price
+
+        buy_order = {
+            'side': 'BUY',
+            'token_id': buy_token,
+            'price': order['price'],
+            'size': size,
+            'type': 'LIMIT',
+            'outcome': order['outcome'],
+            'current_price': order['current_price']
+        }
+        sell_order = {
+            'side': 'SELL',
+            'token_id': sell_token,
+            'price': round(sell_price * 0.985, 4),
+            'size': size,
+            'type': 'LIMIT',
+            'outcome': sell_outcome,
+            'current_price': sell_price
+        }
 
         return jsonify({
             'success': True,
@@ -537,86 +575,47 @@ def place_orders():
         if not market:
             return jsonify({'success': False, 'error': 'No active market'}), 400
 
-        # 解析 clobTokenIds (API返回的是字符串形式的JSON数组)
-        import json
-        token_ids_str = market.get('clobTokenIds', '[]')
-        token_ids = json.loads(token_ids_str) if isinstance(token_ids_str, str) else token_ids_str
+        # 解析 clobTokenIds / outcomePrices (API返回的是字符串形式的JSON数组)
+        up_token, down_token, up_price, down_price = market_prices(market)
 
-        if len(token_ids) < 2:
+        if not up_token or not down_token:
             return jsonify({'success': False, 'error': 'Missing token IDs'}), 400
 
-        up_token = token_ids[0]
-        down_token = token_ids[1]
-
-        # 解析 outcomePrices (同样是字符串形式的JSON数组)
-        outcome_prices_str = market.get('outcomePrices', '[0.5, 0.5]')
-        outcome_prices = json.loads(outcome_prices_str) if isinstance(outcome_prices_str, str) else outcome_prices_str
-
-        up_price = float(outcome_prices[0]) if outcome_prices else 0.5
-        down_price = float(outcome_prices[1]) if outcome_prices else 0.5
-
         size = data.get('size', 10)
 
         # 获取 CLOB 客户端
-        client = get_clob_client()
-        if not client:
+        if not get_clob_client():
             return jsonify({'success': False, 'error': 'Failed to initialize CLOB client'}), 500
 
         # 策略：只买入价格较低的一方
-        if up_price < down_price:
-            # Up 便宜，买入 Up
-            order_args = OrderArgs(
-                token_id=up_token,
-                price=round(up_price * 1.015, 4),
-                size=size,
-                side='BUY'
-            )
-            outcome = 'Up'
-            current_price = up_price
-            print(f"策略: UP价格较低({up_price*100:.2f}%)，买入UP")
-        else:
-            # Down 便宜，买入 Down
-            order_args = OrderArgs(
-                token_id=down_token,
-                price=round(down_price * 1.015, 4),
-                size=size,
-                side='BUY'
-            )
-            outcome = 'Down'
-            current_price = down_price
-            print(f"策略: DOWN价格较低({down_price*100:.2f}%)，买入DOWN")
-
-        # 执行下单
-        results = []
-
-        try:
-            # 下单（创建并提交订单）
-            response = client.create_and_post_order(order_args)
-            # 提取订单ID
-            order_id = 'N/A'
-            if hasattr(response, 'orderId'):
-                order_id = str(response.orderId)
-            elif hasattr(response, 'order') and hasattr(response.order, 'orderId'):
-                order_id = str(response.order.orderId)
-            elif isinstance(response, dict) and 'orderId' in response:
-                order_id = str(response['orderId'])
-
-            results.append({
+        order = buy_cheaper_side(up_price, down_price, {'size': size})
+        outcome = order['outcome']
+        current_price = order['current_price']
+        print(f"策略: {outcome.upper()}价格较低({current_price*100:.2f}%)，买入{outcome.upper()}")
+
+        # 执行下单（与策略引擎共用下单器）
+        result = order_submitter.submit(
+            up_token if outcome == 'Up' else down_token,
+            order['price'], size,
+            source='api', outcome=outcome, current_price=current_price
+        )
+        if result['success']:
+            results = [{
                 'side': 'BUY',
                 'outcome': outcome,
-                'price': order_args.price,
+                'price': order['price'],
                 'current_price': current_price,
                 'size': size,
-                'order_id': order_id,
+                'order_id': result['order_id'],
                 'success': True
-            })
-        except Exception as e:
-            results.append({
+            }]
+        else:
+            results = [{
                 'side': 'BUY',
                 'outcome': outcome,
-                'error': str(e),
+                'error': result['error'],
                 'success': False
-            })
+            }]
 
         # 检查是否有成功的订单
         success_count = sum(1 for r in results if r.get('success'))
@@ -628,11 +627,164 @@ def place_orders():
                 'question': market.get('question'),
                 'end_date': market.get('endDate')
             },
-            'summary': f'成功下单 {success_count}/1 - 买入{outcome} (当前{current_price*100:.1f}% → {order_args.price*100:.1f}%)'
+            'summary': f'成功下单 {success_count}/1 - 买入{outcome} (当前{current_price*100:.1f}% → {order["price"]*100:.1f}%)'
         })
 
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+# 启动阶段：预热连接、解析当前和下一个窗口的市场、派生 CLOB 凭证
+startup = {'ready': False, 'import_seconds': None, 'warmup_seconds': None, 'steps': {}}
+
+def _warmup_step(name, func):
+    started = time.perf_counter()
+    try:
+        result = func()
+        status = result if isinstance(result, str) else 'ok'
+    except Exception as e:
+        status = f'error: {e}'
+    startup['steps'][name] = {'status': status, 'seconds': round(time.perf_counter() - started, 3)}
+
+def _warm_connections():
+    # 只为建立连接池中的 TLS 连接，不经过熔断器，响应内容不关心
+    market_cache.session.get('https://clob.polymarket.com/time', timeout=5)
+    positions_session.get('https://data-api.polymarket.com/', timeout=5)
+
+def _warm_clob_client():
+    if not PRIVATE_KEY:
+        return 'skipped'
+    if not get_clob_client():
+        raise RuntimeError('Failed to initialize CLOB client')
+
+def warmup():
+    """并行执行各预热步骤，完成后标记就绪（单个步骤失败不阻塞就绪）"""
+    started = time.perf_counter()
+    current_period = (int(time.time()) // 900) * 900
+
+    steps = {
+        'connections': _warm_connections,
+        'clob_client': _warm_clob_client,
+        'btc_market': get_current_btc_market,
+    }
+    for coin in ['btc', 'eth']:
+        for period in [current_period, current_period + 900]:
+            slug = f"{coin}-updown-15m-{period}"
+            steps[slug] = lambda slug=slug: market_cache.get_event_market(slug)
+
+    threads = [threading.Thread(target=_warmup_step, args=(name, func), daemon=True) for name, func in steps.items()]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    startup['warmup_seconds'] = round(time.perf_counter() - started, 3)
+    startup['ready'] = True
+    failed = [name for name, step in startup['steps'].items() if step['status'].startswith('error')]
+    print(f"✅ 预热完成: {startup['warmup_seconds']}s" + (f"，失败: {failed}" if failed else ''))
+
+def start_warmup():
+    threading.Thread(target=warmup, daemon=True, name='warmup').start()
+
+_startup_pid = None
+_startup_lock = threading.Lock()
+
+def engine_autostart_allowed():
+    """
+    是否允许随启动自动运行策略引擎
+
+    WSGI 服务器可能有多个工作进程，每个进程都会导入本模块；只有配置了共享状态后端
+    （租约和风控占用在进程间共享），或确定只有一个进程（直接运行本文件、
+    STRATEGY_SINGLE_PROCESS=1）时才自动启动，否则每个进程都会各自下单。
+    """
+    if not isinstance(state_backend, MemoryBackend):
+        return True
+    return __name__ == '__main__' or os.environ.get('STRATEGY_SINGLE_PROCESS') == '1'
+
+def _reset_after_fork():
+    """重建父进程创建的连接、锁和线程池，子进程重新预热"""
+    global _client_instance, _client_lock
+    _client_instance = None
+    _client_lock = threading.Lock()
+    state_backend.reset_after_fork()
+    market_cache.reset_after_fork()
+    positions_cache.reset_after_fork()
+    reset_positions_session()
+    startup.update({'ready': False, 'warmup_seconds': None, 'steps': {}})
+
+def on_startup():
+    """
+    启动钩子：后台预热，STRATEGY_ENGINE=1 时启动策略引擎
+
+    模块导入时自动调用（debug reloader 父进程除外）；每个进程只执行一次，
+    WSGI 服务器在 fork 后（如 gunicorn 的 post_fork）可再次调用，
+    此时先重建从父进程继承的连接池和线程池。
+    """
+    global _startup_pid
+    with _startup_lock:
+        if _startup_pid == os.getpid():
+            return
+        forked = _startup_pid is not None
+        _startup_pid = os.getpid()
+    if forked:
+        _reset_after_fork()
+    start_warmup()
+    if os.environ.get('STRATEGY_ENGINE') == '1':
+        if engine_autostart_allowed():
+            strategy_engine.start()
+        else:
+            print("⚠️ 未启动策略引擎：多进程部署需要设置 STATE_BACKEND=redis://...，"
+                  "单进程运行请设置 STRATEGY_SINGLE_PROCESS=1")
+
+@app.route('/api/ready')
+def ready():
+    """就绪检查：预热完成前返回 503，供负载均衡滚动发布使用"""
+    return jsonify({'success': True, **startup}), 200 if startup['ready'] else 503
+
+@app.route('/api/metrics')
+def metrics():
+    """序列化耗时、缓存命中和熔断器状态"""
+    json_stats = dict(fastjson.stats)
+    json_stats['avg_ms'] = json_stats['total_ms'] / json_stats['count'] if json_stats['count'] else 0.0
+    return jsonify({
+        'success': True,
+        'json': json_stats,
+        'market_cache': dict(market_cache.stats),
+        'circuit_breakers': {host: breaker.status() for host, breaker in BREAKERS.items()},
+        'startup': startup,
+        'state_backend': type(state_backend).__name__,
+        'positions_cache': dict(positions_cache.stats)
+    })
+
+@app.route('/api/strategy/status')
+def strategy_status():
+    """策略引擎状态和最近的下单记录"""
+    status = strategy_engine.status()
+    status['recent_orders'] = order_submitter.recent_orders(20)
+    return jsonify({'success': True, **status})
+
+@app.route('/api/strategy/start', methods=['POST'])
+def strategy_start():
+    """启动策略引擎"""
+    try:
+        strategy_engine.start()
+        return jsonify({'success': True, **strategy_engine.status()})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/strategy/stop', methods=['POST'])
+def strategy_stop():
+    """停止策略引擎"""
+    strategy_engine.stop()
+    return jsonify({'success': True})
+
+startup['import_seconds'] = round(time.perf_counter() - _IMPORT_STARTED, 3)
+print(f"模块加载耗时: {startup['import_seconds']}s")
+
+# debug 模式下 reloader 父进程只负责监控文件，预热和引擎只在子进程运行；
+# WSGI 服务器导入模块时直接执行。STARTUP_ON_IMPORT=0 可关闭（例如脚本中只导入函数）
+_reloader_parent = __name__ == '__main__' and os.environ.get('WERKZEUG_RUN_MAIN') != 'true'
+if os.environ.get('STARTUP_ON_IMPORT', '1') == '1' and not _reloader_parent:
+    on_startup()
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=80, debug=True)
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+"""
+Polymarket 15分钟窗口策略回测工具
+回放本地记录的每个窗口价格/盘口数据，模拟成交，并行扫描参数组合
+
+数据格式：目录下的 *.jsonl 文件，每行一条记录
+  行情: {"slug": "btc-updown-15m-1700000000", "ts": 1700000030,
+         "up_price": 0.48, "down_price": 0.52, "up_ask": 0.49, "down_ask": 0.53}
+  结算: {"slug": "btc-updown-15m-1700000000", "winner": "Up"}
+up_ask / down_ask 可省略，省略时用 up_price / down_price 判断成交。
+"""
+import argparse
+import bisect
+import itertools
+import os
+import sys
+import time
+from collections import defaultdict
+from multiprocessing import Pool, cpu_count
+
+import fastjson
+from strategy import STRATEGIES
+
+WINDOW_SECONDS = 15 * 60
+
+# 回测专用参数（其余参数原样传给策略函数）
+DEFAULT_BACKTEST_PARAMS = {
+    'entry_offset': 0,     # 窗口开始后多少秒触发策略
+    # 限价单挂单多少秒未成交则撤单；默认挂到窗口结束，与实盘一致（GTC 订单，服务器不撤单）
+    'fill_timeout': WINDOW_SECONDS,
+}
+
+
+def load_windows(data_dir):
+    """读取目录下所有 jsonl 记录，按窗口聚合，返回按开始时间排序的窗口列表"""
+    ticks = defaultdict(list)
+    winners = {}
+
+    for name in sorted(os.listdir(data_dir)):
+        if not name.endswith('.jsonl'):
+            continue
+        with open(os.path.join(data_dir, name), encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                record = fastjson.loads(line)
+                slug = record.get('slug')
+                if not slug:
+                    continue
+                if 'winner' in record:
+                    winners[slug] = record['winner']
+                elif 'ts' in record:
+                    ticks[slug].append(record)
+
+    windows = []
+    for slug, rows in ticks.items():
+        winner = winners.get(slug)
+        if winner not in ('Up', 'Down'):
+            continue  # 未结算的窗口无法计算盈亏
+
+        rows.sort(key=lambda r: r['ts'])
+        start_ts = int(slug.rsplit('-', 1)[-1])
+
+        # 预先展开为数组，回测时只做下标访问
+        up = [float(r['up_price']) for r in rows]
+        down = [float(r['down_price']) for r in rows]
+        windows.append({
+            'slug': slug,
+            'start_ts': start_ts,
+            'winner': winner,
+            'offsets': [r['ts'] - start_ts for r in rows],
+            'up': up,
+            'down': down,
+            'up_ask': [float(r.get('up_ask', up[i])) for i, r in enumerate(rows)],
+            'down_ask': [float(r.get('down_ask', down[i])) for i, r in enumerate(rows)],
+        })
+
+    windows.sort(key=lambda w: w['start_ts'])
+    return windows
+
+
+def simulate_window(window, strategy_func, params):
+    """
+    在单个窗口上运行策略并模拟成交
+
+    返回 (order, fill_price)，未下单返回 (None, None)，未成交 fill_price 为 None。
+    限价买单在 entry 之后 fill_timeout 秒内（不超过窗口结束），盘口卖价 ≤ 限价即按卖价成交。
+    """
+    offsets = window['offsets']
+    n = len(offsets)
+
+    # 找到触发时刻的行情（offsets 已按时间排序）
+    i = bisect.bisect_left(offsets, params['entry_offset'])
+    if i >= n:
+        return None, None
+
+    order = strategy_func(window['up'][i], window['down'][i], params)
+    if not order:
+        return None, None
+
+    asks = window['up_ask'] if order['outcome'] == 'Up' else window['down_ask']
+    deadline = min(offsets[i] + params['fill_timeout'], WINDOW_SECONDS)
+    limit = order['price']
+
+    for j in range(i, n):
+        if offsets[j] > deadline:
+            break
+        if asks[j] <= limit:
+            return order, asks[j]
+
+    return order, None
+
+
+def evaluate(windows, strategy_func, params):
+    """在全部窗口上评估一组参数，返回统计指标"""
+    orders = fills = wins = 0
+    cost = pnl = peak = max_drawdown = 0.0
+
+    for window in windows:
+        order, fill_price = simulate_window(window, strategy_func, params)
+        if order is None:
+            continue
+        orders += 1
+        if fill_price is None:
+            continue
+
+        fills += 1
+        size = order['size']
+        cost += size * fill_price
+        if order['outcome'] == window['winner']:
+            wins += 1
+            pnl += size * (1 - fill_price)
+        else:
+            pnl -= size * fill_price
+
+        peak = max(peak, pnl)
+        max_drawdown = max(max_drawdown, peak - pnl)
+
+    return {
+        'params': params,
+        'orders': orders,
+        'fills': fills,
+        'wins': wins,
+        'win_rate': wins / fills if fills else 0.0,
+        'cost': round(cost, 4),
+        'pnl': round(pnl, 4),
+        'roi': pnl / cost if cost else 0.0,
+        'max_drawdown': round(max_drawdown, 4),
+    }
+
+
+# 子进程全局数据（由 _init_worker 设置，避免每个任务重复传输窗口数据）
+_worker_windows = None
+_worker_strategy = None
+
+
+def _init_worker(windows, strategy_name):
+    global _worker_windows, _worker_strategy
+    _worker_windows = windows
+    _worker_strategy = STRATEGIES[strategy_name]
+
+
+def _evaluate_batch(param_batch):
+    """子进程：批量评估一组参数"""
+    return [evaluate(_worker_windows, _worker_strategy, p) for p in param_batch]
+
+
+def build_param_grid(grid, base=None):
+    """
+    展开参数网格
+
+    grid: {'markup': [1.0, 1.015], 'entry_offset': [0, 60]} -> 参数字典列表
+    """
+    params = dict(DEFAULT_BACKTEST_PARAMS)
+    if base:
+        params.update(base)
+
+    keys = list(grid.keys())
+    combos = []
+    for values in itertools.product(*(grid[k] for k in keys)):
+        p = dict(params)
+        p.update(zip(keys, values))
+        combos.append(p)
+    return combos
+
+
+def run_sweep(windows, strategy_name, param_sets, workers=None, batch_size=None):
+    """多进程并行扫描参数组合，返回按 pnl 降序的结果"""
+    if strategy_name not in STRATEGIES:
+        raise ValueError(f"未知策略: {strategy_name}")
+
+    workers = workers or cpu_count()
+    if not batch_size:
+        # 每个进程约分到 4 批，兼顾负载均衡和进程间通信开销
+        batch_size = max(1, len(param_sets) // (workers * 4))
+
+    batches = [param_sets[i:i + batch_size] for i in range(0, len(param_sets), batch_size)]
+
+    if workers == 1 or len(batches) == 1:
+        _init_worker(windows, strategy_name)
+        results = [r for batch in batches for r in _evaluate_batch(batch)]
+    else:
+        with Pool(workers, initializer=_init_worker, initargs=(windows, strategy_name)) as pool:
+            results = [r for batch in pool.imap_unordered(_evaluate_batch, batches) for r in batch]
+
+    results.sort(key=lambda r: r['pnl'], reverse=True)
+    return results
+
+
+def parse_grid_arg(text):
+    """解析 --grid 参数，例如 markup=1.0,1.01,1.015"""
+    key, _, values = text.partition('=')
+    if not key or not values:
+        raise argparse.ArgumentTypeError(f"无效的网格参数: {text}")
+    return key, [float(v) for v in values.split(',')]
+
+
+def print_report(results, top, elapsed, total_windows):
+    print(f"=" * 80)
+    print(f"回测报告")
+    print(f"=" * 80)
+    print(f"窗口数: {total_windows}, 参数组合: {len(results)}, 耗时: {elapsed:.2f}s")
+    print()
+    print(f"【前 {min(top, len(results))} 组参数】")
+    for r in results[:top]:
+        shown = {k: v for k, v in r['params'].items() if k != 'size'}
+        print(f"  pnl: ${r['pnl']:9.2f}  roi: {r['roi']*100:6.2f}%  "
+              f"胜率: {r['win_rate']*100:5.1f}%  成交: {r['fills']:4d}/{r['orders']:4d}  "
+              f"回撤: ${r['max_drawdown']:8.2f}  {shown}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='回测 15 分钟窗口策略')
+    parser.add_argument('data_dir', help='记录数据目录（*.jsonl）')
+    parser.add_argument('--strategy', default='buy_cheaper_side', choices=sorted(STRATEGIES))
+    parser.add_argument('--grid', action='append', type=parse_grid_arg, default=[],
+                        help='参数网格，可重复，例如 --grid markup=1.0,1.015 --grid entry_offset=0,60')
+    parser.add_argument('--size', type=float, default=10)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--top', type=int, default=20)
+    args = parser.parse_args()
+
+    windows = load_windows(args.data_dir)
+    if not windows:
+        print(f"❌ 没有可用的已结算窗口: {args.data_dir}")
+        sys.exit(1)
+
+    param_sets = build_param_grid(dict(args.grid), base={'size': args.size})
+
+    start = time.time()
+    results = run_sweep(windows, args.strategy, param_sets, workers=args.workers)
+    print_report(results, args.top, time.time() - start, len(windows))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+按上游主机的熔断器
+连续失败达到阈值后熔断，熔断期间请求立即失败；冷却后放行一个试探请求，成功则恢复
+"""
+import threading
+import time
+from urllib.parse import urlparse
+
+FAILURE_THRESHOLD = 5     # 连续失败多少次后熔断
+RESET_TIMEOUT = 30.0      # 熔断多少秒后允许试探
+
+
+class CircuitOpenError(Exception):
+    """熔断中，请求未发出"""
+
+    def __init__(self, name, retry_in):
+        super().__init__(f"{name} 熔断中，{retry_in:.0f}s 后重试")
+        self.name = name
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """状态: closed（正常）/ open（熔断）/ half_open（试探中）"""
+
+    def __init__(self, name, failure_threshold=FAILURE_THRESHOLD, reset_timeout=RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self.stats = {'calls': 0, 'failures': 0, 'rejected': 0, 'opened': 0}
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """请求前调用，熔断中抛出 CircuitOpenError"""
+        with self._lock:
+            if self.state == 'open':
+                retry_in = self.opened_at + self.reset_timeout - time.time()
+                if retry_in > 0:
+                    self.stats['rejected'] += 1
+                    raise CircuitOpenError(self.name, retry_in)
+                # 冷却结束，只放行一个试探请求
+                self.state = 'half_open'
+            elif self.state == 'half_open':
+                self.stats['rejected'] += 1
+                raise CircuitOpenError(self.name, self.reset_timeout)
+            self.stats['calls'] += 1
+
+    def record_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self.stats['failures'] += 1
+            if self.state == 'half_open' or self.failures >= self.failure_threshold:
+                if self.state != 'open':
+                    self.stats['opened'] += 1
+                    print(f"⚠️ {self.name} 熔断（连续失败 {self.failures} 次）")
+                self.state = 'open'
+                self.opened_at = time.time()
+
+    def status(self):
+        with self._lock:
+            return {'state': self.state, 'failures': self.failures, **self.stats}
+
+
+BREAKERS = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(host):
+    with _breakers_lock:
+        if host not in BREAKERS:
+            BREAKERS[host] = CircuitBreaker(host)
+        return BREAKERS[host]
+
+
+def guarded_get(session, url, **kwargs):
+    """
+    经过熔断器的 GET 请求
+
+    session 可以是 requests.Session 或 requests 模块；网络异常、5xx 和 429 计为失败。
+    """
+    breaker = get_breaker(urlparse(url).netloc)
+    breaker.before_call()
+    try:
+        response = session.get(url, **kwargs)
+    except Exception:
+        breaker.record_failure()
+        raise
+
+    if response.status_code >= 500 or response.status_code == 429:
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+    return response
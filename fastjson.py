@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+JSON 编解码后端 - 优先使用 orjson，未安装时回退到标准库 json
+设置 JSON_BACKEND=json 可强制使用标准库
+"""
+import json
+import os
+import threading
+import time
+
+
+def _std_loads(data):
+    return json.loads(data)
+
+
+def _std_dumps(obj):
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+BACKENDS = {
+    'json': (_std_loads, _std_dumps),
+}
+
+try:
+    import orjson
+
+    def _orjson_dumps(obj):
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            # orjson 不支持的类型（如超过 64 位的整数）交给标准库处理
+            return _std_dumps(obj)
+
+    BACKENDS['orjson'] = (orjson.loads, _orjson_dumps)
+except ImportError:
+    pass
+
+BACKEND = os.environ.get('JSON_BACKEND') or ('orjson' if 'orjson' in BACKENDS else 'json')
+if BACKEND not in BACKENDS:
+    print(f"未知的 JSON_BACKEND: {BACKEND}，使用标准库 json")
+    BACKEND = 'json'
+
+# loads 接受 str/bytes，dumps 返回 UTF-8 bytes
+loads, dumps = BACKENDS[BACKEND]
+
+# 序列化耗时统计（/api/metrics）
+stats = {'backend': BACKEND, 'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'bytes': 0}
+_stats_lock = threading.Lock()
+
+
+def _record(elapsed_ms, size):
+    with _stats_lock:
+        stats['count'] += 1
+        stats['total_ms'] += elapsed_ms
+        stats['max_ms'] = max(stats['max_ms'], elapsed_ms)
+        stats['bytes'] += size
+
+
+def timed_dumps(obj):
+    """序列化并记录耗时，返回 (bytes, 毫秒)"""
+    start = time.perf_counter()
+    body = dumps(obj)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    _record(elapsed_ms, len(body))
+    return body, elapsed_ms
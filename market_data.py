@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""
+gamma-api 市场缓存
+市场数据进入缓存时一次性解析字符串形式的 clobTokenIds / outcomes / outcomePrices，
+之后所有读取方直接使用列表
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+import fastjson
+from circuit_breaker import CircuitOpenError, guarded_get
+from state_backend import INSTANCE_ID, StateBackendError
+
+GAMMA_URL = 'https://gamma-api.polymarket.com'
+
+
+def normalize_market(market):
+    """把 gamma 返回的字符串数组字段解析为列表（outcomePrices 转为 float），原地修改并返回"""
+    if not market or market.get('_normalized'):
+        return market
+
+    for field in ('clobTokenIds', 'outcomes', 'outcomePrices'):
+        value = market.get(field)
+        if isinstance(value, str):
+            try:
+                market[field] = fastjson.loads(value)
+            except ValueError:
+                market[field] = []
+
+    prices = market.get('outcomePrices')
+    if prices:
+        market['outcomePrices'] = [float(p) for p in prices]
+
+    market['_normalized'] = True
+    return market
+
+
+def _fill_meta(meta, age, stale):
+    if meta is not None:
+        meta['age'] = age
+        meta['stale'] = stale
+
+
+class MarketCache:
+    """
+    按 slug 缓存 gamma 市场，短 TTL；不存在的市场同样缓存，避免窗口创建前反复请求
+
+    过期后只要有 stale_if_error 秒内的旧数据就不阻塞：后台刷新，最多等待 revalidate_wait 秒，
+    刷新未完成（上游慢、失败或熔断）时返回旧数据。只有没有可用数据时才同步请求上游。
+    传入 meta 字典可得到 {'age', 'stale'}。
+
+    设置 backend（见 state_backend.py）时，本地缓存未命中会先读共享快照；需要请求上游时
+    先抢占租约，其它实例等待持有租约的实例写入结果，多个实例共用一次上游请求。
+    """
+
+    def __init__(self, ttl=2.0, revalidate_wait=0.5, stale_if_error=300.0, session=None,
+                 backend=None, lease_wait=2.0):
+        self.ttl = ttl
+        self.backend = backend
+        self.lease_wait = lease_wait
+        self.revalidate_wait = revalidate_wait
+        self.stale_if_error = stale_if_error
+        self.session = session or requests.Session()
+        self.entries = {}   # (kind, slug) -> (fetched_at, market)
+        self.stats = {'hits': 0, 'fetches': 0, 'stale': 0, 'errors': 0, 'shared_hits': 0}
+        self._lock = threading.Lock()
+        self._inflight = {}   # key -> Future
+        self._executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='market-revalidate')
+
+    # --- 共享快照 ---
+
+    def _shared_key(self, key):
+        return f"market:{key[0]}:{key[1]}"
+
+    def _load_shared(self, key):
+        """读取共享快照，返回 (fetched_at, market) 或 None"""
+        if self.backend is None:
+            return None
+        try:
+            raw = self.backend.get(self._shared_key(key))
+        except StateBackendError as e:
+            print(f"读取共享市场快照失败: {e}")
+            return None
+        if raw is None:
+            return None
+        snapshot = fastjson.loads(raw)
+        return snapshot['fetched_at'], snapshot['market']
+
+    def _store(self, key, fetched_at, market):
+        with self._lock:
+            self.entries[key] = (fetched_at, market)
+            # 只保留最近的窗口
+            if len(self.entries) > 64:
+                for old in sorted(self.entries, key=lambda k: self.entries[k][0])[:-32]:
+                    del self.entries[old]
+
+    def _acquire_lease(self, key, timeout):
+        """抢占上游请求租约；没有共享后端或后端不可用时视为抢到"""
+        if self.backend is None:
+            return True
+        try:
+            return self.backend.set_if_absent(f"lease:{self._shared_key(key)}", INSTANCE_ID, ttl=timeout)
+        except StateBackendError:
+            return True
+
+    def _release_lease(self, key):
+        if self.backend is None:
+            return
+        try:
+            self.backend.delete(f"lease:{self._shared_key(key)}")
+        except StateBackendError:
+            pass
+
+    def _wait_shared(self, key, newer_than):
+        """等待持有租约的实例写入新快照，超时返回 None"""
+        deadline = time.time() + self.lease_wait
+        while time.time() < deadline:
+            shared = self._load_shared(key)
+            if shared and shared[0] > newer_than:
+                self.stats['shared_hits'] += 1
+                self._store(key, *shared)
+                return shared
+            time.sleep(0.05)
+        return None
+
+    def _fetch(self, key, path, extract, timeout):
+        """请求上游并写入缓存；5xx / 429 抛出异常，不覆盖已有数据"""
+        acquired = self._acquire_lease(key, timeout)
+        if not acquired:
+            with self._lock:
+                entry = self.entries.get(key)
+            shared = self._wait_shared(key, entry[0] if entry else 0)
+            if shared:
+                return shared[1]
+        try:
+            return self._fetch_upstream(key, path, extract, timeout)
+        finally:
+            # 等待超时后自行请求时，租约仍属于其它实例，不能删除
+            if acquired:
+                self._release_lease(key)
+
+    def _fetch_upstream(self, key, path, extract, timeout):
+        self.stats['fetches'] += 1
+        resp = guarded_get(self.session, f"{GAMMA_URL}{path}", timeout=timeout)
+        if resp.status_code >= 500 or resp.status_code == 429:
+            resp.raise_for_status()
+
+        market = None
+        if resp.status_code == 200:
+            market = normalize_market(extract(fastjson.loads(resp.content)))
+
+        fetched_at = time.time()
+        self._store(key, fetched_at, market)
+        if self.backend is not None:
+            try:
+                self.backend.set(self._shared_key(key), fastjson.dumps({'fetched_at': fetched_at, 'market': market}),
+                                 ttl=self.stale_if_error)
+            except StateBackendError as e:
+                print(f"写入共享市场快照失败: {e}")
+        return market
+
+    def _revalidate(self, key, path, extract, timeout):
+        try:
+            self._fetch(key, path, extract, timeout)
+        except Exception as e:
+            self.stats['errors'] += 1
+            print(f"后台刷新市场失败 {key[1]}: {e}")
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def _revalidate_async(self, key, path, extract, timeout):
+        """后台刷新，同一个 key 只有一个刷新任务，返回该任务的 Future"""
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is None:
+                future = self._executor.submit(self._revalidate, key, path, extract, timeout)
+                self._inflight[key] = future
+            return future
+
+    def reset_after_fork(self):
+        """
+        fork 后在子进程调用
+
+        父进程的连接池不能在进程间共用；线程池的工作线程不会随 fork 复制，
+        已提交的任务和进行中的刷新在子进程永远不会完成。
+        """
+        self.session = requests.Session()
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='market-revalidate')
+
+    def _get(self, kind, slug, path, extract, fresh=False, timeout=3, meta=None):
+        key = (kind, slug)
+        with self._lock:
+            entry = self.entries.get(key)
+
+        # 本地未命中时先看其它实例写入的共享快照
+        if not fresh and (entry is None or time.time() - entry[0] >= self.ttl):
+            shared = self._load_shared(key)
+            if shared and (entry is None or shared[0] > entry[0]):
+                self.stats['shared_hits'] += 1
+                self._store(key, *shared)
+                entry = shared
+        age = time.time() - entry[0] if entry else None
+
+        if entry and not fresh:
+            if age < self.ttl:
+                self.stats['hits'] += 1
+                _fill_meta(meta, age, False)
+                return entry[1]
+            if age < self.stale_if_error:
+                future = self._revalidate_async(key, path, extract, timeout)
+                try:
+                    future.result(timeout=self.revalidate_wait)
+                except Exception:
+                    pass
+                with self._lock:
+                    latest = self.entries.get(key)
+                if latest and latest[0] > entry[0]:
+                    _fill_meta(meta, time.time() - latest[0], False)
+                    return latest[1]
+                self.stats['stale'] += 1
+                _fill_meta(meta, age, True)
+                return entry[1]
+
+        try:
+            market = self._fetch(key, path, extract, timeout)
+        except Exception as e:
+            self.stats['errors'] += 1
+            if entry and age < self.stale_if_error:
+                if not isinstance(e, CircuitOpenError):
+                    print(f"获取市场失败 {slug}，返回 {age:.0f}s 前的数据: {e}")
+                self.stats['stale'] += 1
+                _fill_meta(meta, age, True)
+                return entry[1]
+            raise
+
+        _fill_meta(meta, 0.0, False)
+        return market
+
+    def get_market(self, slug, fresh=False, timeout=3, meta=None):
+        """/markets/slug/{slug}"""
+        return self._get('market', slug, f"/markets/slug/{slug}", lambda data: data or None,
+                         fresh=fresh, timeout=timeout, meta=meta)
+
+    def get_event_market(self, slug, fresh=False, timeout=3, meta=None):
+        """/events/slug/{slug} 的第一个市场"""
+        def extract(data):
+            if data and data.get('markets'):
+                return data['markets'][0]
+            return None
+
+        return self._get('event', slug, f"/events/slug/{slug}", extract,
+                         fresh=fresh, timeout=timeout, meta=meta)
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""
+持仓缓存 - data-api /positions 接口的按钱包缓存
+短 TTL 内直接复用；过期后重新拉取，内容哈希未变化时跳过 JSON 解析和后续处理
+"""
+import hashlib
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import fastjson
+from circuit_breaker import CircuitOpenError, guarded_get
+from state_backend import INSTANCE_ID, StateBackendError
+
+POSITIONS_URL = 'https://data-api.polymarket.com/positions'
+
+# 复用连接，避免每次请求重新建立 TLS 连接
+session = requests.Session()
+
+
+def fetch_positions_raw(wallet):
+    """请求 data-api，返回原始响应内容，失败返回 None"""
+    response = guarded_get(session, POSITIONS_URL, params={'user': wallet, 'limit': 500}, timeout=5)
+    if not response.ok:
+        return None
+    return response.content
+
+
+def reset_session():
+    """fork 后在子进程调用：替换连接池，不复用父进程建立的连接"""
+    for prefix in ('https://', 'http://'):
+        session.mount(prefix, HTTPAdapter())
+
+
+def _fill_meta(meta, age, stale):
+    if meta is not None:
+        meta['age'] = age
+        meta['stale'] = stale
+
+
+class PositionsCache:
+    """
+    按钱包缓存持仓
+
+    get(wallet) 返回 (positions, digest)；memo(wallet, key, compute) 缓存基于持仓的处理结果，
+    持仓内容哈希变化时自动失效。返回的持仓列表是共享的，调用方不要修改。
+    同一钱包同一时刻只有一次上游请求，并发请求等待并复用它的结果。
+    过期后只要有 stale_if_error 秒内的旧数据就不阻塞：后台刷新，最多等待 revalidate_wait 秒，
+    刷新未完成（上游慢、失败或熔断）时返回旧数据；传入 meta 字典可得到 {'age', 'stale'}。
+    设置 backend 时原始持仓通过共享后端在实例间复用，同一钱包同一时刻只有一个实例请求上游。
+    """
+
+    def __init__(self, ttl=5.0, stale_if_error=300.0, fetcher=fetch_positions_raw, max_derived=32,
+                 backend=None, lease_wait=2.0, revalidate_wait=0.5):
+        self.ttl = ttl
+        self.revalidate_wait = revalidate_wait
+        self.backend = backend
+        self.lease_wait = lease_wait
+        self.stale_if_error = stale_if_error
+        self.fetcher = fetcher
+        self.max_derived = max_derived
+        self.entries = {}   # wallet -> {'digest', 'positions', 'fetched_at', 'derived'}
+        self.stats = {'hits': 0, 'fetches': 0, 'unchanged': 0, 'changed': 0, 'invalidations': 0, 'memo_hits': 0,
+                      'stale': 0, 'errors': 0, 'shared_hits': 0}
+        self._lock = threading.Lock()
+        self._inflight = {}     # wallet -> Future，结果为 (entry, error)
+        self._generation = {}   # wallet -> 失效次数，失效前发出的请求结果不再写入缓存
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='positions-revalidate')
+
+    # --- 共享快照 ---
+
+    def _load_shared(self, key):
+        """读取共享快照，返回 (fetched_at, raw) 或 None"""
+        if self.backend is None:
+            return None
+        try:
+            value = self.backend.get(f"positions:{key}")
+        except StateBackendError as e:
+            print(f"读取共享持仓失败: {e}")
+            return None
+        if value is None:
+            return None
+        fetched_at, _, raw = value.partition(b'\n')
+        return float(fetched_at), raw
+
+    def _fetch(self, key, wallet, newer_than):
+        """
+        请求上游，返回 (fetched_at, raw)，失败时 raw 为 None
+
+        其它实例正在请求同一钱包时，先等待它写入的共享快照。
+        """
+        # fetched_at 取响应到达的时间，上游慢时不会一拿到就已过期
+        if self.backend is None:
+            raw = self.fetcher(wallet)
+            return time.time(), raw
+
+        lease = f"lease:positions:{key}"
+        try:
+            acquired = self.backend.set_if_absent(lease, INSTANCE_ID, ttl=10)
+        except StateBackendError:
+            acquired = True
+
+        if not acquired:
+            deadline = time.time() + self.lease_wait
+            while time.time() < deadline:
+                shared = self._load_shared(key)
+                if shared and shared[0] > newer_than:
+                    self.stats['shared_hits'] += 1
+                    return shared
+                time.sleep(0.05)
+
+        try:
+            raw = self.fetcher(wallet)
+            fetched_at = time.time()
+            if raw is not None:
+                try:
+                    self.backend.set(f"positions:{key}", b'%f\n' % fetched_at + raw, ttl=self.stale_if_error)
+                except StateBackendError as e:
+                    print(f"写入共享持仓失败: {e}")
+            return fetched_at, raw
+        finally:
+            if acquired:
+                try:
+                    self.backend.delete(lease)
+                except StateBackendError:
+                    pass
+
+    def _load(self, key, wallet):
+        """读取共享快照或请求上游并更新缓存，返回 (entry, error)，失败时 entry 为 None"""
+        with self._lock:
+            entry = self.entries.get(key)
+            generation = self._generation.get(key, 0)
+
+        # 其它实例刚拉取过的持仓直接复用
+        shared = self._load_shared(key)
+        if shared and time.time() - shared[0] < self.ttl and (entry is None or shared[0] > entry['fetched_at']):
+            self.stats['shared_hits'] += 1
+            fetched_at, raw = shared
+        else:
+            self.stats['fetches'] += 1
+            try:
+                fetched_at, raw = self._fetch(key, wallet, entry['fetched_at'] if entry else 0)
+            except Exception as e:
+                return None, e
+            if raw is None:
+                return None, 'upstream error'
+
+        digest = hashlib.sha1(raw).hexdigest()
+        if entry and entry['digest'] == digest:
+            self.stats['unchanged'] += 1
+            entry['fetched_at'] = fetched_at
+            return entry, None
+
+        self.stats['changed'] += 1
+        loaded = {
+            'digest': digest,
+            'positions': fastjson.loads(raw),
+            'fetched_at': fetched_at,
+            'derived': {},
+        }
+        with self._lock:
+            # 请求期间缓存被失效（例如刚下单成交），结果只返回给本次调用方
+            if self._generation.get(key, 0) == generation:
+                self.entries[key] = loaded
+        return loaded, None
+
+    def _load_once(self, key, wallet):
+        """同一钱包同一时刻只执行一次 _load，并发调用等待同一个结果"""
+        with self._lock:
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self._inflight[key] = Future()
+        if not owner:
+            return future.result()
+
+        try:
+            future.set_result(self._load(key, wallet))
+        except Exception as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                if self._inflight.get(key) is future:
+                    del self._inflight[key]
+        return future.result()
+
+    def _revalidate_async(self, key, wallet):
+        """后台刷新，已有请求在进行时直接返回它的 Future"""
+        with self._lock:
+            future = self._inflight.get(key)
+        if future is None:
+            future = self._executor.submit(self._load_once, key, wallet)
+        return future
+
+    def reset_after_fork(self):
+        """fork 后在子进程调用：父进程的刷新线程和进行中的请求在子进程不会完成"""
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='positions-revalidate')
+
+    def get(self, wallet, meta=None):
+        """返回 (positions, digest)，上游失败且没有可用旧数据时返回 (None, None)"""
+        key = wallet.lower()
+        with self._lock:
+            entry = self.entries.get(key)
+        age = time.time() - entry['fetched_at'] if entry else None
+        if entry and age < self.ttl:
+            self.stats['hits'] += 1
+            _fill_meta(meta, age, False)
+            return entry['positions'], entry['digest']
+
+        # 有可用旧数据时不阻塞：后台刷新，最多等待 revalidate_wait 秒
+        if entry and age < self.stale_if_error:
+            future = self._revalidate_async(key, wallet)
+            try:
+                loaded, error = future.result(timeout=self.revalidate_wait)
+            except Exception as e:
+                loaded, error = None, e
+            if loaded is not None:
+                _fill_meta(meta, time.time() - loaded['fetched_at'], False)
+                return loaded['positions'], loaded['digest']
+            if future.done():
+                self.stats['errors'] += 1
+                if not isinstance(error, CircuitOpenError):
+                    print(f"获取持仓失败 {wallet}，返回 {age:.0f}s 前的数据: {error}")
+            self.stats['stale'] += 1
+            _fill_meta(meta, age, True)
+            return entry['positions'], entry['digest']
+
+        loaded, error = self._load_once(key, wallet)
+        if loaded is None:
+            self.stats['errors'] += 1
+            if isinstance(error, Exception):
+                raise error
+            return None, None
+
+        _fill_meta(meta, time.time() - loaded['fetched_at'], False)
+        return loaded['positions'], loaded['digest']
+
+    def memo(self, wallet, key, compute, meta=None):
+        """
+        缓存持仓处理结果
+
+        key 需包含处理所依赖的其它输入（如当前市场标题）；持仓未变化且 key 相同时直接返回上次结果。
+        上游失败时返回 None。
+        """
+        positions, digest = self.get(wallet, meta=meta)
+        if positions is None:
+            return None
+
+        entry = self.entries.get(wallet.lower())
+        if entry is None or entry['digest'] != digest:
+            return compute(positions)
+
+        derived = entry['derived']
+        if key in derived:
+            self.stats['memo_hits'] += 1
+            return derived[key]
+
+        result = compute(positions)
+        if len(derived) >= self.max_derived:
+            derived.clear()
+        derived[key] = result
+        return result
+
+    def invalidate(self, wallet):
+        """立即失效某个钱包的缓存（例如自己的订单成交后）"""
+        key = wallet.lower()
+        with self._lock:
+            self._generation[key] = self._generation.get(key, 0) + 1
+            # 之后的请求不再等待失效前发出的请求
+            self._inflight.pop(key, None)
+            if self.entries.pop(key, None) is not None:
+                self.stats['invalidations'] += 1
+        # 删除共享快照，其它实例的本地缓存最多再保留 ttl 秒
+        if self.backend is not None:
+            try:
+                self.backend.delete(f"positions:{key}")
+            except StateBackendError as e:
+                print(f"删除共享持仓失败: {e}")
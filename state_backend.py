@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""
+共享状态后端 - 多实例部署时共享市场快照、持仓缓存和下单记录
+默认使用进程内存；STATE_BACKEND=redis://host:6379/0 时使用 Redis 协议的服务
+
+后端接口（值均为 bytes）:
+  get(key) / set(key, value, ttl=None) / set_if_absent(key, value, ttl) / delete(key)
+  push(key, value, max_len=None) / items(key)
+Redis 后端出错时抛出 StateBackendError，调用方自行决定降级方式
+"""
+import os
+import select
+import socket
+import threading
+import time
+from collections import deque
+from urllib.parse import unquote, urlparse
+
+# 当前实例标识，用于租约（同一时刻只有一个实例请求上游 / 运行策略）
+INSTANCE_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+
+class StateBackendError(Exception):
+    """共享状态后端不可用"""
+
+
+class MemoryBackend:
+    """进程内存后端（单实例默认）"""
+
+    def __init__(self):
+        self.values = {}   # key -> (value, expires_at)
+        self.lists = {}    # key -> deque
+        self._lock = threading.Lock()
+
+    def _alive(self, key, now):
+        item = self.values.get(key)
+        if item is None:
+            return None
+        if item[1] is not None and item[1] <= now:
+            del self.values[key]
+            return None
+        return item
+
+    def get(self, key):
+        with self._lock:
+            item = self._alive(key, time.time())
+            return item[0] if item else None
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self.values[key] = (value, time.time() + ttl if ttl else None)
+
+    def set_if_absent(self, key, value, ttl=None):
+        with self._lock:
+            now = time.time()
+            if self._alive(key, now):
+                return False
+            self.values[key] = (value, now + ttl if ttl else None)
+            return True
+
+    def delete(self, key):
+        with self._lock:
+            self.values.pop(key, None)
+            self.lists.pop(key, None)
+
+    def push(self, key, value, max_len=None):
+        with self._lock:
+            items = self.lists.setdefault(key, deque())
+            items.append(value)
+            while max_len and len(items) > max_len:
+                items.popleft()
+
+    def items(self, key):
+        with self._lock:
+            return list(self.lists.get(key, ()))
+
+    def reset_after_fork(self):
+        """fork 后在子进程调用：父进程的锁可能处于持有状态"""
+        self._lock = threading.Lock()
+
+
+class RedisBackend:
+    """
+    Redis 协议后端（RESP2），不依赖 redis-py
+
+    单连接 + 锁串行执行命令，连接断开时下一条命令自动重连。
+    命令发出后读取响应失败时不重试（RPUSH、SET NX 等重复执行会出错），直接抛出 StateBackendError。
+    connect 可替换为返回 socket 风格对象的函数，便于对接本地服务或假实现。
+    """
+
+    def __init__(self, url='redis://localhost:6379/0', timeout=1.0, connect=None):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or 'localhost'
+        self.port = parsed.port or 6379
+        self.password = unquote(parsed.password) if parsed.password else None
+        self.db = int(parsed.path.lstrip('/') or 0)
+        self.timeout = timeout
+        self.connect = connect or (lambda: socket.create_connection((self.host, self.port), timeout=self.timeout))
+        self._sock = None
+        self._buf = b''
+        self._lock = threading.Lock()
+
+    # --- RESP ---
+
+    @staticmethod
+    def _encode(args):
+        out = [b'*%d\r\n' % len(args)]
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode('utf-8')
+            out.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+        return b''.join(out)
+
+    def _readline(self):
+        while b'\r\n' not in self._buf:
+            chunk = self._sock.recv(65536)
+            if not chunk:
+                raise ConnectionError('connection closed')
+            self._buf += chunk
+        line, self._buf = self._buf.split(b'\r\n', 1)
+        return line
+
+    def _readexact(self, n):
+        while len(self._buf) < n + 2:
+            chunk = self._sock.recv(65536)
+            if not chunk:
+                raise ConnectionError('connection closed')
+            self._buf += chunk
+        data, self._buf = self._buf[:n], self._buf[n + 2:]
+        return data
+
+    def _read_reply(self):
+        line = self._readline()
+        kind, rest = line[:1], line[1:]
+        if kind == b'+':
+            return rest.decode('utf-8')
+        if kind == b'-':
+            raise StateBackendError(rest.decode('utf-8'))
+        if kind == b':':
+            return int(rest)
+        if kind == b'$':
+            n = int(rest)
+            return None if n < 0 else self._readexact(n)
+        if kind == b'*':
+            n = int(rest)
+            return None if n < 0 else [self._read_reply() for _ in range(n)]
+        raise StateBackendError(f"未知的响应: {line[:20]!r}")
+
+    def _open(self):
+        self._sock = self.connect()
+        self._buf = b''
+        # 握手失败时关闭连接，避免后续命令复用未认证的连接
+        try:
+            if self.password:
+                self._send('AUTH', self.password)
+            if self.db:
+                self._send('SELECT', self.db)
+        except BaseException:
+            self._close()
+            raise
+
+    def _send(self, *args):
+        self._sock.sendall(self._encode(args))
+        return self._read_reply()
+
+    def _dropped(self):
+        """复用连接前检查对端是否已关闭（如服务端空闲超时），此时命令还未发出，可以安全重连"""
+        try:
+            readable, _, _ = select.select([self._sock], [], [], 0)
+            return bool(readable) and not self._sock.recv(1, socket.MSG_PEEK)
+        except OSError:
+            return True
+        except (TypeError, ValueError, AttributeError):
+            return False   # connect 返回的对象不支持 select 时跳过检查
+
+    def execute(self, *args):
+        """执行一条命令；连接或发送失败时重连重试一次，命令已发出后失败不重试"""
+        with self._lock:
+            for attempt in range(2):
+                sent = False
+                try:
+                    if self._sock is not None and self._dropped():
+                        self._close()
+                    if self._sock is None:
+                        self._open()
+                    self._sock.sendall(self._encode(args))
+                    sent = True
+                    return self._read_reply()
+                except StateBackendError:
+                    raise
+                except OSError as e:
+                    self._close()
+                    if sent or attempt:
+                        raise StateBackendError(f"{self.host}:{self.port} {e}") from e
+
+    def _close(self):
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except OSError:
+                pass
+        self._sock = None
+
+    def reset_after_fork(self):
+        """fork 后在子进程调用：不复用父进程的连接，下一条命令重新连接"""
+        self._close()
+        self._buf = b''
+        self._lock = threading.Lock()
+
+    # --- 后端接口 ---
+
+    def get(self, key):
+        return self.execute('GET', key)
+
+    def set(self, key, value, ttl=None):
+        if ttl:
+            self.execute('SET', key, value, 'PX', int(ttl * 1000))
+        else:
+            self.execute('SET', key, value)
+
+    def set_if_absent(self, key, value, ttl=None):
+        args = ['SET', key, value, 'NX']
+        if ttl:
+            args += ['PX', int(ttl * 1000)]
+        return self.execute(*args) == 'OK'
+
+    def delete(self, key):
+        self.execute('DEL', key)
+
+    def push(self, key, value, max_len=None):
+        self.execute('RPUSH', key, value)
+        if max_len:
+            self.execute('LTRIM', key, -max_len, -1)
+
+    def items(self, key):
+        return self.execute('LRANGE', key, 0, -1) or []
+
+
+def create_backend(url=None):
+    """根据 URL 创建后端：空值为内存后端，redis:// 为 Redis 协议后端"""
+    if not url or url == 'memory':
+        return MemoryBackend()
+    if url.startswith('redis://'):
+        return RedisBackend(url)
+    raise ValueError(f"不支持的 STATE_BACKEND: {url}")
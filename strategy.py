@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+交易策略 - 纯函数实现，服务器下单和回测共用
+"""
+import fastjson
+
+# 默认参数：买入较便宜的一方，限价 = 现价 × 1.015
+DEFAULT_PARAMS = {
+    'markup': 1.015,
+    'size': 10,
+}
+
+
+def parse_json_list(value, default):
+    """解析字符串形式的JSON数组（gamma-api 的 clobTokenIds / outcomePrices）"""
+    if value is None:
+        return default
+    if isinstance(value, str):
+        try:
+            return fastjson.loads(value)
+        except ValueError:
+            return default
+    return value
+
+
+def market_prices(market):
+    """从 gamma 市场数据中取出 (up_token, down_token, up_price, down_price)"""
+    token_ids = parse_json_list(market.get('clobTokenIds'), [])
+    outcome_prices = parse_json_list(market.get('outcomePrices'), [0.5, 0.5])
+
+    up_token = token_ids[0] if len(token_ids) > 0 else ''
+    down_token = token_ids[1] if len(token_ids) > 1 else ''
+    up_price = float(outcome_prices[0]) if outcome_prices else 0.5
+    down_price = float(outcome_prices[1]) if len(outcome_prices) > 1 else 0.5
+
+    return up_token, down_token, up_price, down_price
+
+
+def buy_cheaper_side(up_price, down_price, params=None):
+    """
+    策略：只买入价格较低的一方
+
+    返回 {'outcome', 'price', 'size', 'current_price'}，不满足条件返回 None。
+    可选参数 max_price / min_price 用于过滤入场价格。
+    """
+    p = dict(DEFAULT_PARAMS)
+    if params:
+        p.update(params)
+
+    if up_price < down_price:
+        outcome, current_price = 'Up', up_price
+    else:
+        outcome, current_price = 'Down', down_price
+
+    if 'max_price' in p and current_price > p['max_price']:
+        return None
+    if 'min_price' in p and current_price < p['min_price']:
+        return None
+
+    return {
+        'outcome': outcome,
+        'price': round(current_price * p['markup'], 4),
+        'size': p['size'],
+        'current_price': current_price,
+    }
+
+
+# 策略注册表：名称 -> 函数(up_price, down_price, params) -> 订单或 None
+STRATEGIES = {
+    'buy_cheaper_side': buy_cheaper_side,
+}
+
+
+def register_strategy(name, func):
+    """注册自定义策略"""
+    STRATEGIES[name] = func
+    return func
@@ -0,0 +1,518 @@
+#!/usr/bin/env python3
+"""
+事件驱动策略引擎
+行情线程轮询 gamma / CLOB 盘口并产生事件，策略线程按事件调用插件策略，
+通过共享下单器提交订单，每个策略有独立的风控限额
+"""
+import json
+import os
+import queue
+import threading
+import time
+
+import fastjson
+from circuit_breaker import guarded_get
+from market_data import MarketCache
+from state_backend import INSTANCE_ID, StateBackendError
+from strategy import STRATEGIES, market_prices
+
+WINDOW_SECONDS = 15 * 60
+PENDING_MAX_AGE = 6 * 3600  # 已结束窗口最多等待多久的结算结果
+LEADER_LEASE_SECONDS = 10   # 多实例部署时只有持有租约的实例运行策略
+
+# 未配置 STRATEGY_CONFIG 时使用的默认插件（与 /api/place_orders 的策略一致）
+DEFAULT_PLUGINS = [
+    {
+        'name': 'btc_buy_cheaper_side',
+        'strategy': 'buy_cheaper_side',
+        'coins': ['btc'],
+        'params': {'markup': 1.015, 'size': 10, 'entry_offset': 0},
+        'limits': {'max_orders_per_window': 1, 'max_size_per_window': 10, 'max_notional_per_window': 10},
+    },
+]
+
+
+def current_period(now=None):
+    """当前15分钟窗口的开始时间戳"""
+    now = int(now if now is not None else time.time())
+    return (now // WINDOW_SECONDS) * WINDOW_SECONDS
+
+
+def extract_order_id(response):
+    """从 create_and_post_order 的返回值中提取订单ID"""
+    if hasattr(response, 'orderId'):
+        return str(response.orderId)
+    if hasattr(response, 'order') and hasattr(response.order, 'orderId'):
+        return str(response.order.orderId)
+    if isinstance(response, dict) and 'orderId' in response:
+        return str(response['orderId'])
+    return 'N/A'
+
+
+class OrderSubmitter:
+    """共享下单器：串行提交订单，记录最近的下单结果（设置 backend 时记录在实例间共享）"""
+
+    def __init__(self, client_factory, on_filled=None, history=100, backend=None):
+        self.client_factory = client_factory
+        self.on_filled = on_filled  # 下单成功后的回调，参数为结果字典
+        self.history = history
+        self.backend = backend
+        self.recent = []
+        self._lock = threading.Lock()
+
+    def recent_orders(self, limit=20):
+        """最近的下单记录，优先读取共享后端"""
+        if self.backend is not None:
+            try:
+                items = self.backend.items('orders:recent')
+                return [fastjson.loads(item) for item in items[-limit:]]
+            except StateBackendError as e:
+                print(f"读取共享下单记录失败: {e}")
+        return self.recent[-limit:]
+
+    def submit(self, token_id, price, size, side='BUY', source='manual', **extra):
+        """提交限价单，返回结果字典（不抛异常）"""
+        result = {'side': side, 'price': price, 'size': size, 'source': source, 'time': time.time()}
+        result.update(extra)
+
+        with self._lock:
+            client = self.client_factory()
+            if not client:
+                result.update({'success': False, 'error': 'Failed to initialize CLOB client'})
+            else:
+                try:
+                    from py_clob_client.clob_types import OrderArgs
+
+                    order_args = OrderArgs(token_id=token_id, price=price, size=size, side=side)
+                    response = client.create_and_post_order(order_args)
+                    result.update({'success': True, 'order_id': extract_order_id(response)})
+                except Exception as e:
+                    result.update({'success': False, 'error': str(e)})
+
+            self.recent.append(result)
+            del self.recent[:-self.history]
+
+        if self.backend is not None:
+            try:
+                self.backend.push('orders:recent', fastjson.dumps(result), max_len=self.history)
+            except StateBackendError as e:
+                print(f"写入共享下单记录失败: {e}")
+
+        if result['success'] and self.on_filled:
+            try:
+                self.on_filled(result)
+            except Exception as e:
+                print(f"下单回调失败: {e}")
+
+        return result
+
+
+class RiskLimits:
+    """单个策略的每窗口风控限额"""
+
+    def __init__(self, max_orders_per_window=1, max_size_per_window=None, max_notional_per_window=None):
+        self.max_orders = max_orders_per_window
+        self.max_size = max_size_per_window
+        self.max_notional = max_notional_per_window
+        self.usage = {}  # slug -> {'orders', 'size', 'notional'}
+        self._lock = threading.Lock()   # 策略线程修改，状态接口读取
+
+    def check(self, slug, price, size):
+        """返回 None 表示允许下单，否则返回拒绝原因"""
+        with self._lock:
+            used = dict(self.usage.get(slug, {'orders': 0, 'size': 0, 'notional': 0}))
+        if self.max_orders is not None and used['orders'] + 1 > self.max_orders:
+            return 'max_orders_per_window'
+        if self.max_size is not None and used['size'] + size > self.max_size:
+            return 'max_size_per_window'
+        if self.max_notional is not None and used['notional'] + price * size > self.max_notional:
+            return 'max_notional_per_window'
+        return None
+
+    def record(self, slug, price, size):
+        """记录一笔下单占用，返回该窗口累计占用（副本）"""
+        with self._lock:
+            used = self.usage.setdefault(slug, {'orders': 0, 'size': 0, 'notional': 0})
+            used['orders'] += 1
+            used['size'] += size
+            used['notional'] += price * size
+            # 按窗口开始时间只保留最近几个窗口（slug 以窗口开始时间戳结尾）
+            cutoff = current_period() - 2 * WINDOW_SECONDS
+            for old in [k for k in self.usage if int(k.rsplit('-', 1)[-1]) < cutoff]:
+                del self.usage[old]
+            return dict(used)
+
+    def snapshot(self):
+        """占用的副本，供状态接口序列化"""
+        with self._lock:
+            return {slug: dict(used) for slug, used in self.usage.items()}
+
+    def merge(self, slug, used):
+        """合并其它实例记录的占用（各项取较大值）"""
+        with self._lock:
+            local = self.usage.setdefault(slug, {'orders': 0, 'size': 0, 'notional': 0})
+            for field in local:
+                local[field] = max(local[field], used.get(field, 0))
+
+
+class MarketFeed(threading.Thread):
+    """
+    行情线程：轮询当前窗口市场和 CLOB 盘口，产生事件放入队列
+
+    事件: {'type': 'window_open' | 'book', 'coin', 'slug', 'start_ts', 'ts',
+           'up_token', 'down_token', 'up_price', 'down_price', 'up_ask', 'down_ask'}
+    设置 record_dir 时同时把行情和结算结果写入 jsonl，供 backtest.py 回放。
+    """
+
+    def __init__(self, events, coins=('btc',), poll_interval=1.0, record_dir=None, market_cache=None):
+        super().__init__(daemon=True, name='market-feed')
+        self.events = events
+        self.market_cache = market_cache or MarketCache()
+        self.coins = list(coins)
+        self.poll_interval = poll_interval
+        self.record_dir = record_dir
+        self.markets = {}      # coin -> 当前窗口 (slug, 市场)
+        self.last_book = {}    # coin -> (up_ask, down_ask, up_price, down_price)
+        self.pending = {}      # slug -> 窗口结束时间，等待结算
+        self.last_resolve_check = 0
+        self._halt = threading.Event()
+
+    def stop(self):
+        self._halt.set()
+
+    def run(self):
+        while not self._halt.is_set():
+            started = time.time()
+            for coin in self.coins:
+                try:
+                    self.poll_coin(coin)
+                except Exception as e:
+                    print(f"行情轮询失败 {coin.upper()}: {e}")
+
+            if self.record_dir and started - self.last_resolve_check >= 60:
+                self.last_resolve_check = started
+                self.resolve_pending()
+
+            self._halt.wait(max(0, self.poll_interval - (time.time() - started)))
+
+    def best_ask(self, token_id):
+        resp = guarded_get(self.market_cache.session, 'https://clob.polymarket.com/book',
+                           params={'token_id': token_id}, timeout=5)
+        if not resp.ok:
+            return None
+        asks = fastjson.loads(resp.content).get('asks') or []
+        return min(float(a['price']) for a in asks) if asks else None
+
+    def poll_coin(self, coin):
+        start_ts = current_period()
+        slug = f"{coin}-updown-15m-{start_ts}"
+
+        current = self.markets.get(coin)
+        if current is None or current[0] != slug:
+            market = self.market_cache.get_event_market(slug)
+            if not market:
+                return
+            # 只有记录行情时才需要等待结算结果
+            if current and self.record_dir:
+                self.pending[current[0]] = time.time()
+            self.markets[coin] = (slug, market)
+            self.last_book.pop(coin, None)
+        else:
+            market = current[1]
+
+        up_token, down_token, _, _ = market_prices(market)
+        up_ask = self.best_ask(up_token)
+        down_ask = self.best_ask(down_token)
+
+        # 只用两边盘口的中间价触发策略；gamma 的 outcomePrices 是窗口开启时的快照，不能用来下单。
+        # 任一边盘口缺失时不产生事件，窗口内第一次拿到完整盘口时产生 window_open 事件
+        if up_ask is None or down_ask is None:
+            return
+        up_price = round((up_ask + (1 - down_ask)) / 2, 4)
+        down_price = round(1 - up_price, 4)
+
+        book = (up_ask, down_ask)
+        window_open = coin not in self.last_book
+        if not window_open and self.last_book[coin] == book:
+            return
+        self.last_book[coin] = book
+
+        event = {
+            'type': 'window_open' if window_open else 'book',
+            'coin': coin,
+            'slug': slug,
+            'start_ts': start_ts,
+            'ts': time.time(),
+            'up_token': up_token,
+            'down_token': down_token,
+            'up_price': up_price,
+            'down_price': down_price,
+            'up_ask': up_ask,
+            'down_ask': down_ask,
+        }
+        self.events.put(event)
+        self.record({k: event[k] for k in ('slug', 'up_price', 'down_price', 'up_ask', 'down_ask')}
+                    | {'ts': int(event['ts'])})
+
+    def resolve_pending(self):
+        """检查已结束窗口的结算结果并写入记录；价格结算为 0/1 之前保留在等待列表中"""
+        for slug, ended_at in list(self.pending.items()):
+            if time.time() - ended_at > PENDING_MAX_AGE:
+                print(f"窗口 {slug} 超过 {PENDING_MAX_AGE // 3600} 小时未结算，不再记录")
+                del self.pending[slug]
+                continue
+            try:
+                market = self.market_cache.get_event_market(slug, fresh=True)
+            except Exception as e:
+                print(f"获取结算结果失败 {slug}: {e}")
+                continue
+            if not market or not market.get('closed'):
+                continue
+            _, _, up_price, down_price = market_prices(market)
+            if up_price in (0.0, 1.0) and up_price + down_price == 1.0:
+                self.record({'slug': slug, 'winner': 'Up' if up_price == 1.0 else 'Down'})
+                del self.pending[slug]
+
+    def record(self, row):
+        if not self.record_dir:
+            return
+        day = time.strftime('%Y%m%d', time.gmtime())
+        with open(os.path.join(self.record_dir, f"{day}.jsonl"), 'a', encoding='utf-8') as f:
+            f.write(fastjson.dumps(row).decode('utf-8') + '\n')
+
+
+class StrategyRunner(threading.Thread):
+    """策略线程：消费行情事件，调用插件策略并通过下单器提交订单"""
+
+    def __init__(self, events, submitter, plugins=None, backend=None, limits=None):
+        super().__init__(daemon=True, name='strategy-runner')
+        self.events = events
+        self.submitter = submitter
+        self.backend = backend
+        self.limits = limits if limits is not None else {}   # 插件名 -> RiskLimits，可由调用方跨次启动保留
+        self.leader_until = 0.0
+        self.plugins = []
+        self.stats = {'events': 0, 'orders': 0, 'rejected': 0, 'last_latency_ms': None}
+        self._lock = threading.Lock()
+        self._halt = threading.Event()
+        for config in plugins or DEFAULT_PLUGINS:
+            self.add_plugin(config)
+
+    def add_plugin(self, config):
+        """添加策略插件，config 格式见 DEFAULT_PLUGINS"""
+        if config['strategy'] not in STRATEGIES:
+            raise ValueError(f"未知策略: {config['strategy']}")
+        name = config.get('name', config['strategy'])
+        if name not in self.limits:
+            self.limits[name] = RiskLimits(**config.get('limits', {}))
+        plugin = {
+            'name': name,
+            'func': STRATEGIES[config['strategy']],
+            'coins': set(config.get('coins', ['btc'])),
+            'params': dict(config.get('params', {})),
+            'limits': self.limits[name],
+            'enabled': config.get('enabled', True),
+        }
+        with self._lock:
+            self.plugins.append(plugin)
+        return plugin
+
+    def stop(self):
+        self._halt.set()
+
+    def run(self):
+        while not self._halt.is_set():
+            # 每轮都检查租约（到期前一半时间续期），行情长时间没有变化时租约也不会过期
+            self.is_leader()
+            try:
+                event = self.events.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            try:
+                self.handle_event(event)
+            except Exception as e:
+                print(f"策略处理事件失败: {e}")
+        self.release_leader()
+
+    def is_leader(self):
+        """
+        多实例时只有一个实例下单：抢占或续期共享后端中的租约
+
+        没有共享后端时总是返回 True；后端不可用时返回 False，宁可漏单也不重复下单。
+        """
+        if self.backend is None:
+            return True
+        now = time.time()
+        if now < self.leader_until:
+            return True
+        key = 'engine:leader'
+        me = INSTANCE_ID.encode('utf-8')   # 后端的值均为 bytes
+        try:
+            holder = self.backend.get(key)
+            if holder is None:
+                acquired = self.backend.set_if_absent(key, me, ttl=LEADER_LEASE_SECONDS)
+            elif holder == me:
+                self.backend.set(key, me, ttl=LEADER_LEASE_SECONDS)
+                acquired = True
+            else:
+                acquired = False
+        except StateBackendError as e:
+            print(f"策略租约检查失败: {e}")
+            acquired = False
+
+        # 提前一半时间续期，避免租约过期后被其它实例抢走
+        self.leader_until = now + LEADER_LEASE_SECONDS / 2 if acquired else 0.0
+        return acquired
+
+    def release_leader(self):
+        """停止时释放自己持有的租约，其它实例不必等租约过期即可接管"""
+        if self.backend is None or not self.leader_until:
+            return
+        self.leader_until = 0.0
+        try:
+            holder = self.backend.get('engine:leader')
+            if holder == INSTANCE_ID.encode('utf-8'):
+                self.backend.delete('engine:leader')
+        except StateBackendError as e:
+            print(f"释放策略租约失败: {e}")
+
+    def reserve(self, plugin, slug, price, size):
+        """
+        检查并占用窗口额度，返回 None 表示可以下单，否则返回拒绝原因
+
+        设置 backend 时占用记录在共享后端，新接管的实例能看到之前实例已用的额度；
+        每笔订单按序号抢占一个配额键，租约交接期间两个实例也不会重复下同一笔。
+        后端不可用时拒绝下单。
+        """
+        limits = plugin['limits']
+        usage_key = f"engine:usage:{plugin['name']}:{slug}"
+        if self.backend is not None:
+            try:
+                shared = self.backend.get(usage_key)
+            except StateBackendError as e:
+                print(f"读取共享风控占用失败: {e}")
+                return 'state_backend_unavailable'
+            if shared is not None:
+                limits.merge(slug, fastjson.loads(shared))
+
+        reason = limits.check(slug, price, size)
+        if reason:
+            return reason
+
+        # 先占用额度，避免下单期间重复触发
+        used = limits.record(slug, price, size)
+        if self.backend is None:
+            return None
+        try:
+            if not self.backend.set_if_absent(f"engine:quota:{plugin['name']}:{slug}:{used['orders']}",
+                                              INSTANCE_ID.encode('utf-8'), ttl=WINDOW_SECONDS * 2):
+                return 'quota_taken'
+            self.backend.set(usage_key, fastjson.dumps(used), ttl=WINDOW_SECONDS * 2)
+        except StateBackendError as e:
+            print(f"写入共享风控占用失败: {e}")
+            return 'state_backend_unavailable'
+        return None
+
+    def handle_event(self, event):
+        with self._lock:
+            self.stats['events'] += 1
+
+        if not self.is_leader():
+            return
+
+        with self._lock:
+            plugins = [p for p in self.plugins if p['enabled'] and event['coin'] in p['coins']]
+
+        offset = event['ts'] - event['start_ts']
+        for plugin in plugins:
+            params = plugin['params']
+            if offset < params.get('entry_offset', 0):
+                continue
+
+            order = plugin['func'](event['up_price'], event['down_price'], params)
+            if not order:
+                continue
+
+            if self.reserve(plugin, event['slug'], order['price'], order['size']):
+                with self._lock:
+                    self.stats['rejected'] += 1
+                continue
+
+            token_id = event['up_token'] if order['outcome'] == 'Up' else event['down_token']
+            result = self.submitter.submit(
+                token_id, order['price'], order['size'],
+                source=plugin['name'], outcome=order['outcome'],
+                current_price=order['current_price'], market_slug=event['slug']
+            )
+            latency_ms = round((time.time() - event['ts']) * 1000, 1)
+            print(f"策略 {plugin['name']}: 买入{order['outcome']} @ {order['price']} "
+                  f"{'成功' if result['success'] else '失败: ' + result.get('error', '')} ({latency_ms}ms)")
+
+            with self._lock:
+                self.stats['orders'] += 1
+                self.stats['last_latency_ms'] = latency_ms
+
+    def status(self):
+        with self._lock:
+            return {
+                'running': self.is_alive(),
+                'leader': time.time() < self.leader_until or self.backend is None,
+                'stats': dict(self.stats),
+                'plugins': [
+                    {'name': p['name'], 'coins': sorted(p['coins']), 'params': p['params'],
+                     'enabled': p['enabled'], 'usage': p['limits'].snapshot()}
+                    for p in self.plugins
+                ],
+            }
+
+
+def load_plugins(path):
+    """从 JSON 文件读取插件配置，未指定时返回默认插件"""
+    if not path:
+        return DEFAULT_PLUGINS
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+class StrategyEngine:
+    """行情线程 + 策略线程的组合，供服务器启动/停止"""
+
+    def __init__(self, submitter, plugins=None, poll_interval=1.0, record_dir=None, market_cache=None,
+                 backend=None):
+        self.submitter = submitter
+        self.backend = backend
+        self.market_cache = market_cache
+        self.plugins = plugins or DEFAULT_PLUGINS
+        self.poll_interval = poll_interval
+        self.record_dir = record_dir
+        # 风控占用在引擎上保留，停止后重新启动不会清空当前窗口的额度
+        self.limits = {}
+        self.feed = None
+        self.runner = None
+
+    def start(self):
+        if any(t and t.is_alive() for t in (self.runner, self.feed)):
+            print("策略引擎已在运行（或尚未完全停止）")
+            return
+        events = queue.Queue()
+        coins = sorted({c for p in self.plugins for c in p.get('coins', ['btc'])})
+        self.runner = StrategyRunner(events, self.submitter, self.plugins, self.backend, self.limits)
+        self.feed = MarketFeed(events, coins, self.poll_interval, self.record_dir, self.market_cache)
+        self.runner.start()
+        self.feed.start()
+        print(f"✅ 策略引擎已启动: {[p['name'] for p in self.runner.plugins]}")
+
+    def stop(self, timeout=10):
+        for thread in (self.feed, self.runner):
+            if thread:
+                thread.stop()
+        # 等待线程退出，之后的 start() 才能重新创建线程
+        for thread in (self.feed, self.runner):
+            if thread and thread.is_alive():
+                thread.join(timeout)
+        print("策略引擎已停止")
+
+    def status(self):
+        if not self.runner:
+            return {'running': False, 'stats': {}, 'plugins': []}
+        return self.runner.status()